@@ -42,9 +42,20 @@ batch = next(iter(datasets['mnist']['train']))
 
 ddpm_pl = AutoencoderLightning(
     AutoencoderConvolutionalVariational(
-        batch, z_size=128, cnn_dim=4, encoder=ModelBatchAdaptor(encoder, ['images']), decoder=decoder
+        batch,
+        z_size=128,
+        cnn_dim=4,
+        encoder=ModelBatchAdaptor(encoder, ['images']),
+        decoder=decoder,
+        compile_model=options.training.compile_model,
+        grad_checkpoint=options.training.grad_checkpoint,
+    ),
+    loss_fn=partial(
+        AutoencoderConvolutionalVariational.loss_function,
+        x_input_name='images',
+        recon_loss_name='L1',
+        compile_loss=options.training.compile_model,
     ),
-    loss_fn=partial(AutoencoderConvolutionalVariational.loss_function, x_input_name='images', recon_loss_name='L1'),
     optimizer_fn=partial(torch.optim.Adam, lr=1e-3),
 )
 
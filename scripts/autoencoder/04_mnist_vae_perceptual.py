@@ -50,7 +50,13 @@ batch = next(iter(datasets['mnist']['train']))
 
 ddpm_pl = AutoencoderLightning(
     AutoencoderConvolutionalVariational(
-        batch, z_size=128, cnn_dim=4, encoder=ModelBatchAdaptor(encoder, ['images']), decoder=decoder
+        batch,
+        z_size=128,
+        cnn_dim=4,
+        encoder=ModelBatchAdaptor(encoder, ['images']),
+        decoder=decoder,
+        compile_model=options.training.compile_model,
+        grad_checkpoint=options.training.grad_checkpoint,
     ),
     # loss_fn=partial(AutoencoderConvolutionalVariational.loss_function, x_input_name='images', recon_loss_name='L1'),
     # loss_fn=partial(AutoencoderConvolutionalVariational.loss_function_v2, recon_loss_fn=LossBceLogitsSigmoid(batch_key='images'), kullback_leibler_weight=0.1),
@@ -58,6 +64,7 @@ ddpm_pl = AutoencoderLightning(
         AutoencoderConvolutionalVariational.loss_function_v2,
         recon_loss_fn=LossL1(batch_key='images'),
         kullback_leibler_weight=0.1,
+        compile_loss=options.training.compile_model,
     ),
     optimizer_fn=partial(torch.optim.Adam, lr=1e-3),
 )
@@ -2,11 +2,15 @@
 Learn a noising function
 """
 
+import os
+from typing import Callable
+
 import torch
 from generative.networks.nets import DiffusionModelUNet
 from monai import transforms
 from torch import nn
-from utils import TransformApplyTo, TransformLambda, batch_images_adapator_0_1
+from torch.utils.checkpoint import checkpoint
+from utils import TransformAddNoise, TransformScaleIntensityUint8, batch_images_uint8_adapator_0_1
 
 from flextrain.callbacks.epoch_summary import CallbackLogMetrics
 from flextrain.callbacks.sample_diffusion import CallbackSample2dDiffusionModel
@@ -14,6 +18,7 @@ from flextrain.callbacks.skip_epochs import CallbackSkipEpoch
 from flextrain.datasets.mnist import mnist_dataset
 from flextrain.diffusion.discrete_ddpm_simple import SimpleGaussianDiffusion
 from flextrain.diffusion.lightning import GaussianDiffusionLightning
+from flextrain.layers.compile import CompiledFunction
 from flextrain.layers.dummy import UNet
 from flextrain.metrics.fid_mnist import create_fid_mnist
 from flextrain.trainer.options import Options
@@ -21,23 +26,58 @@ from flextrain.trainer.start_training import start_training
 
 
 class DiffusionModelUNetConditioned(nn.Module):
-    def __init__(self, base_model: nn.Module, image_conditioning_name: str) -> None:
+    def __init__(
+        self,
+        base_model: nn.Module,
+        image_conditioning_name: str,
+        compile_model: bool = False,
+        grad_checkpoint: bool = False,
+    ) -> None:
         super().__init__()
         self.base_model = base_model
         self.image_conditioning_name = image_conditioning_name
+        # trade compute (activations recalculated during the backward pass) for memory
+        self.grad_checkpoint = grad_checkpoint
+        self._shape_checked = False
+
+        # the sampling loop repeatedly calls the model with a fixed shape: this
+        # is the ideal case for `reduce-overhead` (i.e., CUDA graphs). The compiled
+        # function is not a module, hence not registered (the state dict is unchanged)
+        self._compiled_base_model = None
+        if compile_model:
+            self._compiled_base_model = CompiledFunction(base_model)
+
+    @property
+    def _base_model_fn(self) -> Callable[..., torch.Tensor]:
+        return self.base_model if self._compiled_base_model is None else self._compiled_base_model
 
     def forward(self, x: torch.Tensor, t: torch.Tensor, **kwargs) -> torch.Tensor:
-        image_conditioning = kwargs.get(self.image_conditioning_name)
-        assert image_conditioning is not None, f'missing input={self.image_conditioning_name}'
-        assert image_conditioning.shape[2:] == x.shape[2:]
+        image_conditioning = kwargs[self.image_conditioning_name]
+        # the shapes are fixed: only check once (stripped with `python -O`)
+        if __debug__ and not self._shape_checked:
+            assert image_conditioning.shape[2:] == x.shape[2:]
+            self._shape_checked = True
+        # channels last: cuDNN can use the tensor core (NHWC) convolutions without layout transposes
+        x = x.contiguous(memory_format=torch.channels_last)
+        image_conditioning = image_conditioning.contiguous(memory_format=torch.channels_last)
         x_cond = torch.cat([x, image_conditioning], dim=1)
-        return self.base_model(x_cond, t)
+        if self.grad_checkpoint and self.training and torch.is_grad_enabled():
+            return checkpoint(self._base_model_fn, x_cond, t, use_reentrant=False)
+        return self._base_model_fn(x_cond, t)
 
 
 if __name__ == '__main__':
+    # use the TF32 tensor cores for the float32 matmul & convolutions (outside autocast)
+    torch.set_float32_matmul_precision('high')
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    # fixed shapes (MNIST, constant batch size): select the fastest convolution algorithms once
+    torch.backends.cudnn.benchmark = True
+
     options = Options()
     options.training.nb_epochs = 101
     options.training.precision = 16
+    options.training.compile_model = True
     options.training.devices = '0'
     # options.training.check_val_every_n_epoch = 5
     options.workflow.enable_progress_bar = False
@@ -56,13 +96,15 @@ if __name__ == '__main__':
             #    padding_mode="zeros",
             #    prob=0.5,
             # ),
-            # avoid padding issues by scaling as the last step
-            transforms.ScaleIntensityRanged(keys=["images"], a_min=0.0, a_max=1.0, b_min=-1.0, b_max=1.0, clip=True),
-            TransformLambda(
-                lambda t: t + torch.randn_like(t),
-                input_names=['images'],
-                output_names=['images_noisy'],
-            ),
+        ]
+    )
+
+    # the images are transferred as uint8 and rescaled then noised on the GPU
+    # (this also avoids padding issues since scaling is the last step)
+    transform_device = transforms.Compose(
+        [
+            TransformScaleIntensityUint8(name='images'),
+            TransformAddNoise(input_name='images', output_name='images_noisy'),
         ]
     )
 
@@ -72,6 +114,11 @@ if __name__ == '__main__':
         transform_valid=transform_train,
         max_train_samples=None,
         shuffle_valid=True,  # show more samples for better comparison & FID real
+        as_uint8=True,
+        num_workers=max(1, (os.cpu_count() or 2) // 2),
+        pin_memory=True,
+        persistent_workers=True,
+        prefetch_factor=4,
     )
 
     model = DiffusionModelUNet(
@@ -83,20 +130,40 @@ if __name__ == '__main__':
         num_res_blocks=1,
         num_head_channels=64,
     )
-    model = DiffusionModelUNetConditioned(model, image_conditioning_name='images')
+    model = model.to(memory_format=torch.channels_last)
+    model = DiffusionModelUNetConditioned(
+        model,
+        image_conditioning_name='images',
+        compile_model=options.training.compile_model,
+        grad_checkpoint=options.training.grad_checkpoint,
+    )
 
     ddpm = SimpleGaussianDiffusion(
         model,
+        # `reduce-overhead` compilation already replays the model with CUDA graphs
+        sample_cuda_graph=not options.training.compile_model,
         # noise_scheduler_fn=sigmoid_beta_schedule
     )
     ddpm_pl = GaussianDiffusionLightning(
         ddpm,
         input_name='images_noisy',
         input_conditioning_names='images',
+        # rescaling & noising on the GPU rather than in the data loader workers
+        batch_transform_fn=transform_device,
     )
 
-    fid = create_fid_mnist()
-    fid_real = [fid(batch_images_adapator_0_1(datasets['mnist']['valid'])) for i in range(10)]
+    # extract the features in bf16 (tensor cores), the statistics are still calculated in float32.
+    # The reference features are also extracted in bf16 so that the FIDs are not biased
+    fid_device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    fid = create_fid_mnist(autocast_dtype=torch.bfloat16, device=fid_device)
+    # the FID classifier was trained on [0, 1] images: the real (adaptor) and the
+    # sampled (`unnorm_fid_fn` of the callback) images must both be in this range
+    # calculate the real features once, then calculate the FID of random subsets of these
+    with torch.inference_mode():
+        real_features = fid.calculate_features(
+            batch_images_uint8_adapator_0_1(datasets['mnist']['valid']), device=fid_device
+        )
+    fid_real = fid.calculate_fid_subsampled(real_features, nb_subsets=10, device=fid_device)
     print('FID REAL data mean=', float(torch.asarray(fid_real).mean()), 'FID STD=', float(torch.asarray(fid_real).std()))
 
     callbacks = [
@@ -50,11 +50,56 @@ class TransformLambda:
         return new_batch
 
 
+class TransformScaleIntensityUint8:
+    """
+    Rescale uint8 images in range [0, 255] to float images in range [-1, 1]
+
+    This is intended to be run on the device, after the batch transfer: the
+    uint8 images are 4x smaller to transfer than float32 images.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __call__(self, batch: Batch) -> Batch:
+        batch[self.name] = batch[self.name].float().mul_(2.0 / 255.0).sub_(1.0).clamp_(-1.0, 1.0)
+        return batch
+
+
+class TransformAddNoise:
+    """
+    Add gaussian noise to a feature and create a new feature from the result
+
+    This is intended to be run on the device, after the batch transfer: the noise
+    is generated directly on the GPU and the noise buffer is reused between batches.
+    """
+
+    def __init__(self, input_name: str, output_name: str) -> None:
+        self.input_name = input_name
+        self.output_name = output_name
+        self.noise = None
+
+    def __call__(self, batch: Batch) -> Batch:
+        t = batch[self.input_name]
+        # a buffer created under inference mode (e.g., validation) can't be updated outside of it
+        if self.noise is None or self.noise.shape != t.shape or self.noise.device != t.device \
+                or self.noise.is_inference():
+            self.noise = torch.empty_like(t)
+        self.noise.normal_()
+        batch[self.output_name] = t + self.noise
+        return batch
+
+
 def batch_images_adapator_0_1(dataloader):
     for batch in dataloader:
         yield (batch['images'] + 1) / 2
 
 
+def batch_images_uint8_adapator_0_1(dataloader):
+    for batch in dataloader:
+        yield batch['images'].float() / 255.0
+
+
 def to_image(data: torch.Tensor, path: str) -> None:
     data_ui8 = 255.0 / 2.0 * (torch.clamp(data.detach().cpu(), -1.0, 1.0) + 1)
     data_ui8 = make_grid(data_ui8, nrow=int(np.sqrt(data_ui8.shape[0]))).type(torch.uint8)
@@ -1,15 +1,90 @@
-from typing import Any, Union, List, Tuple
+from functools import partial
+from math import prod
+from typing import Any, Callable, Union, List, Tuple
 
 import torch.nn as nn
 import torch.nn.functional as F
 import torch
-from torch import flatten
-import numpy as np
+from torch.utils.checkpoint import checkpoint
 
+from ..layers.compile import CompiledFunction
 from ..losses import LossL1, LossOutput
 from .ae import AutoEncoderType
 
 
+def _kullback_leibler_per_sample(mu: torch.Tensor, logvar: torch.Tensor) -> torch.Tensor:
+    # see Appendix B from VAE paper:
+    # Kingma and Welling. Auto-Encoding Variational Bayes. ICLR, 2014
+    # https://arxiv.org/abs/1312.6114
+    # 0.5 * sum(1 + log(sigma^2) - mu^2 - sigma^2)
+    kullback_leibler = -0.5 * (1.0 + logvar - mu.square() - logvar.exp())
+    return kullback_leibler.mean(dim=tuple(range(1, mu.dim())))
+
+
+# the KL divergence is memory bound: fuse the pointwise operations and the reduction in a single kernel
+_kullback_leibler_per_sample_compiled = CompiledFunction(
+    _kullback_leibler_per_sample, modes=('default',), fullgraph=True, dynamic=False
+)
+
+
+def kullback_leibler_per_sample(mu: torch.Tensor, logvar: torch.Tensor, compile_loss: bool = False) -> torch.Tensor:
+    """
+    Kullback–Leibler divergence between ``N(mu, exp(logvar))`` and ``N(0, 1)``, averaged per sample
+
+    Args:
+        compile_loss: if True, use the compiled version of the loss
+    """
+    if compile_loss:
+        return _kullback_leibler_per_sample_compiled(mu, logvar)
+    return _kullback_leibler_per_sample(mu, logvar)
+
+
+def _l1_loss(recon_x: torch.Tensor, x: torch.Tensor) -> torch.Tensor:
+    return F.pairwise_distance(recon_x, x, p=1, keepdim=True)
+
+
+_reconstruction_losses = {
+    'BCEL': partial(F.binary_cross_entropy_with_logits, reduction='none'),
+    'BCE': partial(F.binary_cross_entropy, reduction='none'),
+    'MSE': partial(F.mse_loss, reduction='none'),
+    'L1': _l1_loss,
+}
+
+
+def _reconstruction_loss_per_sample(
+        recon_x: torch.Tensor,
+        x: torch.Tensor,
+        loss_fn: Callable[[torch.Tensor, torch.Tensor], torch.Tensor]) -> torch.Tensor:
+    recon_loss = loss_fn(recon_x, x)
+    return recon_loss.mean(dim=tuple(range(1, recon_loss.dim())))
+
+
+# compiled, the per-sample mean is fused with the pointwise loss: the full size
+# loss tensor is reduced in registers instead of being written then read back
+_reconstruction_loss_per_sample_compiled = CompiledFunction(
+    _reconstruction_loss_per_sample, modes=('default',), dynamic=False
+)
+
+
+def reconstruction_loss_per_sample(
+        recon_x: torch.Tensor, x: torch.Tensor, recon_loss_name: str, compile_loss: bool = False) -> torch.Tensor:
+    """
+    Reconstruction loss, averaged per sample
+
+    Args:
+        recon_loss_name: the name of the reconstruction loss. Must be one of ``BCEL`` (binary cross-entropy
+            with logits), ``BCE`` (binary cross-entropy), ``MSE`` (mean squared error) or ``L1``
+        compile_loss: if True, use the compiled version of the loss
+    """
+    loss_fn = _reconstruction_losses.get(recon_loss_name)
+    if loss_fn is None:
+        raise NotImplementedError(f'loss not implemented={recon_loss_name}')
+
+    if compile_loss:
+        return _reconstruction_loss_per_sample_compiled(recon_x, x, loss_fn)
+    return _reconstruction_loss_per_sample(recon_x, x, loss_fn)
+
+
 class AutoencoderConvolutionalVariational(AutoEncoderType):
     """
     Variational convolutional autoencoder implementation
@@ -24,7 +99,10 @@ class AutoencoderConvolutionalVariational(AutoEncoderType):
             cnn_dim: int,
             encoder: nn.Module,
             decoder: nn.Module,
-            z_size: int):
+            z_size: int,
+            compile_model: bool = False,
+            grad_checkpoint: bool = False,
+            channels_last: bool = False):
         """
 
         Args:
@@ -32,23 +110,37 @@ class AutoencoderConvolutionalVariational(AutoEncoderType):
             input_shape: the shape, including the ``N`` and ``C`` components (e.g., [N, C, H, W...]) of
                 the encoder
             encoder: the encoder taking ``x`` and returning an encoding to be mapped to a latent space
-            decoder: the decoder, taking input ``z`` and mapping back to input space ``x``. If the decoder output
-                is not ``x`` shaped, it will be padded or cropped to the right shape
+            decoder: the decoder, taking input ``z`` projected to the encoder output shape and mapping back to
+                input space ``x``. If the decoder output is not ``x`` shaped, it will be padded or cropped to the
+                right shape
             z_size: the size of the latent variable
             input_type: the type of ``x`` variable
+            compile_model: if True, the encoder and decoder are compiled using ``torch.compile``
+                (``reduce-overhead`` mode, falling back to ``default`` mode on failure)
+            grad_checkpoint: if True, the activations of the encoder and decoder are not stored during the
+                forward pass but recalculated during the backward pass. This trades compute (roughly
+                one extra forward pass) for memory to enable larger batches
+            channels_last: if True and the input and encoding are NCHW, the encoder and decoder use the channels last
+                (NHWC) memory format, allowing cuDNN to select tensor core convolutions without
+                layout transposes. The checkpoints do not depend on this flag
         """
         super().__init__()
         self.decoder = decoder
         self.encoder = encoder
         self.z_size = z_size
+        self.grad_checkpoint = grad_checkpoint
 
         # calculate the encoding size
         with torch.no_grad():
             encoding = encoder(x)
             # remove the N component, then multiply the rest
-            self.encoder_output_size = np.asarray(encoding.shape[1:]).prod()
+            self.encoder_output_size = prod(encoding.shape[1:])
         self.cnn_dim = cnn_dim - 2  # remove the N, C components
-        self.encoding_shape = encoding.shape
+        # record the shape of a single encoding (i.e., without the N component)
+        # so that we can decode any number of samples
+        self.encoding_shape_nc = tuple(encoding.shape[1:])
+        # channels last requires NCHW inputs and encodings
+        self.channels_last = channels_last and cnn_dim == 4 and len(self.encoding_shape_nc) == 3
 
         # in the original paper (Kingma & Welling 2015, we
         # have a z_mean and z_var, but the problem is that
@@ -57,49 +149,134 @@ class AutoencoderConvolutionalVariational(AutoEncoderType):
         # has a z_mean and z_log_var component, and when we need
         # the regular variance or std_dev, we simply use
         # an exponential function
-        self.z_logvar = nn.Linear(self.encoder_output_size, z_size)
-        self.z_mu = nn.Linear(self.encoder_output_size, z_size)
+        #
+        # z_mean and z_log_var are calculated using a single projection
+        # (i.e., one GEMM reading the encoding once) and split afterwards
+        self.z_proj = nn.Linear(self.encoder_output_size, 2 * z_size)
+
+        # project the latent variable back to the encoder output space (decoder input)
+        self.z_to_decoder = nn.Linear(z_size, self.encoder_output_size)
+        self._register_load_state_dict_pre_hook(self._load_previous_versions)
+
+        if self.channels_last:
+            self.encoder.to(memory_format=torch.channels_last)
+            self.decoder.to(memory_format=torch.channels_last)
+
+        # the compiled functions are not modules, hence not registered as sub-modules:
+        # `self.encoder` and `self.decoder` own the parameters (checkpoints & EMA are unchanged)
+        self._compiled_encoder = None
+        self._compiled_decoder = None
+        if compile_model:
+            self._compiled_encoder = CompiledFunction(self.encoder, dynamic=False)
+            self._compiled_decoder = CompiledFunction(self.decoder, dynamic=False)
+
+    @property
+    def _encoder_fn(self):
+        return self.encoder if self._compiled_encoder is None else self._compiled_encoder
+
+    @property
+    def _decoder_fn(self):
+        return self.decoder if self._compiled_decoder is None else self._compiled_decoder
+
+    def _load_previous_versions(self, state_dict, prefix, *args, **kwargs):
+        """
+        Support checkpoints from previous versions:
+            - separate ``z_mu`` and ``z_logvar`` projections are merged into ``z_proj``
+            - without ``z_to_decoder``, ``z`` was directly reshaped as an encoding (i.e.,
+              ``z_size == encoder_output_size``): this is an identity projection
+        """
+        for name in ('weight', 'bias'):
+            mu_name = f'{prefix}z_mu.{name}'
+            logvar_name = f'{prefix}z_logvar.{name}'
+            if mu_name in state_dict and logvar_name in state_dict:
+                state_dict[f'{prefix}z_proj.{name}'] = torch.cat(
+                    [state_dict.pop(mu_name), state_dict.pop(logvar_name)], dim=0
+                )
+
+        weight_name = f'{prefix}z_to_decoder.weight'
+        bias_name = f'{prefix}z_to_decoder.bias'
+        if weight_name not in state_dict and bias_name not in state_dict and self.z_size == self.encoder_output_size:
+            reference = self.z_to_decoder.weight
+            state_dict[weight_name] = torch.eye(self.z_size, dtype=reference.dtype, device=reference.device)
+            state_dict[bias_name] = torch.zeros(self.z_size, dtype=reference.dtype, device=reference.device)
+
+    def _run(self, fn, x):
+        if self.grad_checkpoint and self.training and torch.is_grad_enabled():
+            return checkpoint(fn, x, use_reentrant=False)
+        return fn(x)
+
+    def _flatten_encoding(self, n):
+        """
+        Flatten the encoding to [N, encoder_output_size]
+
+        The encoding is always flattened in the logical NCHW order so that the ``z_proj`` weights do not
+        depend on the memory layout (i.e., a view for contiguous encodings, a copy with channels last)
+        """
+        return n.flatten(1)
+
+    def _unflatten_encoding(self, z):
+        """
+        Reshape a flattened encoding to [N, C, H, W...]
+        """
+        nd_z = z.view(z.size(0), *self.encoding_shape_nc)
+        if self.channels_last:
+            nd_z = nd_z.contiguous(memory_format=torch.channels_last)
+        return nd_z
+
+    def _z_to_decoder_input(self, z):
+        """
+        Project the latent variable ``z`` to the decoder input [N, C, H, W...]
+        """
+        return self._unflatten_encoding(self.z_to_decoder(z))
 
     def encode(self, x):
-        n = self.encoder(x)
+        if self.channels_last and isinstance(x, torch.Tensor):
+            x = x.contiguous(memory_format=torch.channels_last)
+        n = self._run(self._encoder_fn, x)
         encoded_shape = n.shape
-        n = flatten(n, 1)
+        n = self._flatten_encoding(n)
 
-        mu = self.z_mu(n)
-        logvar = self.z_logvar(n)
+        mu, logvar = self.z_proj(n).chunk(2, dim=1)
         return mu, logvar, encoded_shape
     
-    def decode(self, mu, logvar, encoded_shape):
-        z = self.reparameterize(self.training, mu, logvar)
-        nd_z = z.view(encoded_shape)
-        recon = self.decoder(nd_z)
-        return recon
-
-    def forward(self, x):
-        mu, logvar = self.encode(x)
-        return self.decode(mu, logvar), mu, logvar
-
-    @staticmethod
-    def reparameterize(training, z_mu, z_logvar):
+    def decode(self, mu, logvar, encoded_shape=None):
         """
+        Decode the latent variables ``mu`` and ``logvar``.
+
         Use the reparameterization ``trick``: we need to generate a
         random normal *without* interrupting the gradient propagation.
 
         We only sample during training.
+
+        ``encoded_shape`` is not used and only kept so that ``decode(*encode(x))`` is valid.
         """
-        if training:
+        if self.training:
             # note that log(x^2) = 2*log(x); hence divide by 2 to get std_dev
             # i.e., std_dev = exp(log(std_dev^2)/2) = exp(log(var)/2)
-            std = torch.exp(0.5 * z_logvar)
-            eps = torch.randn_like(std)
-            z = z_mu + eps * std
+            # fresh noise for each call: `eps` is saved for the backward and must not be modified in place
+            eps = torch.randn_like(mu)
+            z = torch.addcmul(mu, eps, (0.5 * logvar).exp_())
         else:
-            z = z_mu
+            z = mu
 
-        return z
+        nd_z = self._z_to_decoder_input(z)
+        recon = self._run(self._decoder_fn, nd_z)
+        return recon
+
+    def forward(self, x):
+        mu, logvar, encoded_shape = self.encode(x)
+        recon = self.decode(mu, logvar, encoded_shape)
+        return recon, mu, logvar
 
     @staticmethod
-    def loss_function(batch, model_output, encoding, x_input_name, recon_loss_name='BCEL', kullback_leibler_weight=0.2):
+    def loss_function(
+            batch,
+            model_output,
+            encoding,
+            x_input_name,
+            recon_loss_name='BCEL',
+            kullback_leibler_weight=0.2,
+            compile_loss=False):
         """
         Loss function generally used for a variational auto-encoder
 
@@ -115,6 +292,8 @@ class AutoencoderConvolutionalVariational(AutoEncoderType):
                 ``MSE`` (mean squared error) or ``L1``
             kullback_leibler_weight: the weight factor applied on the Kullback–Leibler divergence. This is to
                 balance the importance of the reconstruction loss and the Kullback–Leibler divergence
+            compile_loss: if True, the losses are compiled using ``torch.compile`` (e.g., set from
+                ``options.training.compile_model``)
 
         Returns:
             a 1D tensor, representing a loss value for each ``x``
@@ -122,24 +301,9 @@ class AutoencoderConvolutionalVariational(AutoEncoderType):
         x = batch[x_input_name]
         recon_x = model_output
         mu, logvar, _ = encoding
-        if recon_loss_name == 'BCEL':
-            recon_loss = F.binary_cross_entropy_with_logits(recon_x, x, reduction='none')
-        elif recon_loss_name == 'BCE':
-            recon_loss = F.binary_cross_entropy(recon_x, x, reduction='none')
-        elif recon_loss_name == 'MSE':
-            recon_loss = F.mse_loss(recon_x,  x, reduction='none')
-        elif recon_loss_name == 'L1':
-            recon_loss = torch.nn.PairwiseDistance(p=1, keepdim=True)(recon_x,  x)
-        else:
-            raise NotImplementedError(f'loss not implemented={recon_loss_name}')
-        recon_loss = flatten(recon_loss, 1).mean(dim=1)
+        recon_loss = reconstruction_loss_per_sample(recon_x, x, recon_loss_name, compile_loss=compile_loss)
 
-        # see Appendix B from VAE paper:
-        # Kingma and Welling. Auto-Encoding Variational Bayes. ICLR, 2014
-        # https://arxiv.org/abs/1312.6114
-        # 0.5 * sum(1 + log(sigma^2) - mu^2 - sigma^2)
-        kullback_leibler = -0.5 * (1 + logvar - mu.pow(2) - logvar.exp())
-        kullback_leibler = flatten(kullback_leibler, 1).mean(dim=1)
+        kullback_leibler = kullback_leibler_per_sample(mu, logvar, compile_loss=compile_loss)
 
         return LossOutput(losses={
             recon_loss_name: recon_loss,
@@ -148,7 +312,7 @@ class AutoencoderConvolutionalVariational(AutoEncoderType):
 
 
     @staticmethod
-    def loss_function_v2(batch, model_output, encoding, recon_loss_fn, kullback_leibler_weight=0.2):
+    def loss_function_v2(batch, model_output, encoding, recon_loss_fn, kullback_leibler_weight=0.2, compile_loss=False):
         """
         Loss function generally used for a variational auto-encoder
 
@@ -164,6 +328,8 @@ class AutoencoderConvolutionalVariational(AutoEncoderType):
                 ``MSE`` (mean squared error) or ``L1``
             kullback_leibler_weight: the weight factor applied on the Kullback–Leibler divergence. This is to
                 balance the importance of the reconstruction loss and the Kullback–Leibler divergence
+            compile_loss: if True, the losses are compiled using ``torch.compile`` (e.g., set from
+                ``options.training.compile_model``)
 
         Returns:
             a 1D tensor, representing a loss value for each ``x``
@@ -176,16 +342,12 @@ class AutoencoderConvolutionalVariational(AutoEncoderType):
         #recon_loss = flatten(recon_loss, 1).mean(dim=1)
         #recon_loss.losses['l1'] = flatten(recon_loss.losses['l1'], 1).mean(dim=1)
 
-        # see Appendix B from VAE paper:
-        # Kingma and Welling. Auto-Encoding Variational Bayes. ICLR, 2014
-        # https://arxiv.org/abs/1312.6114
-        # 0.5 * sum(1 + log(sigma^2) - mu^2 - sigma^2)
-        kullback_leibler = -0.5 * (1 + logvar - mu.pow(2) - logvar.exp())
-        kullback_leibler = flatten(kullback_leibler, 1).mean(dim=1)
+        kullback_leibler = kullback_leibler_per_sample(mu, logvar, compile_loss=compile_loss)
 
         recon_loss.losses['kl'] = kullback_leibler * kullback_leibler_weight
         return recon_loss
 
+    @torch.inference_mode()
     def sample(self, nb_samples):
         """
         Randomly sample from the latent space to generate random samples
@@ -198,8 +360,6 @@ class AutoencoderConvolutionalVariational(AutoEncoderType):
         """
         device = next(iter(self.parameters())).device
         random_z = torch.randn([nb_samples, self.z_size], dtype=torch.float32, device=device)
-        #shape = [nb_samples, self.z_size] + [1] * self.cnn_dim
-        #random_z = random_z.view(shape)
-        random_z = random_z.view(self.encoding_shape)
-        random_samples = self.decoder(random_z)
+        nd_z = self._z_to_decoder_input(random_z)
+        random_samples = self._decoder_fn(nd_z)
         return random_samples
\ No newline at end of file
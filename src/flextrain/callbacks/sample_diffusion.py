@@ -12,6 +12,7 @@ from torchvision.utils import make_grid
 
 from ..diffusion.utils import catch_all_and_log
 from ..metrics.fid import FID
+from ..trainer.utils import transfer_batch_to_device
 from ..types import Batch
 
 logger = logging.getLogger(__name__)
@@ -100,6 +101,11 @@ class CallbackSample2dDiffusionModel(L.Callback):
                     # restart the sequence
                     batch_iter = get_batch_iter()
                     batch = next(batch_iter)
+
+                # the batch is not processed by the trainer: apply the same
+                # on-device processing as for the training (e.g., noising)
+                batch = transfer_batch_to_device(batch, pl_module.device)
+                batch = pl_module.on_after_batch_transfer(batch, 0)
                 true_batches.append(self.unnorm_fn(batch[self.input_name]).detach().cpu())
 
             conditioning = {}
@@ -125,16 +131,18 @@ class CallbackSample2dDiffusionModel(L.Callback):
             else:
                 x_T = torch.randn_like(batch[self.input_name])
 
-            image = pl_module.sample(x_T=x_T, **self.sample_kwargs, **conditioning)
-            image_sampled.append(self.unnorm_fn(image).detach().cpu())
-
-            if self.fid is not None:
-                # we need to normalize the image the same way the classifier
-                # was trained on which may not necessarily be how
-                # the diffusion model was preprocessed
-                image_fid = self.unnorm_fid_fn(image)
-                features = self.fid.calculate_features([image_fid], device=image_fid.device)
-                fid_features.append(features.detach().cpu())
+            # no autograd graph nor view tracking for the sampling
+            with torch.inference_mode():
+                image = pl_module.sample(x_T=x_T, **self.sample_kwargs, **conditioning)
+                image_sampled.append(self.unnorm_fn(image).detach().cpu())
+
+                if self.fid is not None:
+                    # we need to normalize the image the same way the classifier
+                    # was trained on which may not necessarily be how
+                    # the diffusion model was preprocessed
+                    image_fid = self.unnorm_fid_fn(image)
+                    features = self.fid.calculate_features([image_fid], device=image_fid.device)
+                    fid_features.append(features.detach().cpu())
 
             batch_n += 1
             nb_samples += len(image)
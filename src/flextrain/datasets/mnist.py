@@ -23,7 +23,18 @@ def mnist_dataset(
     dataset_transformer_train: Optional[Callable[[Dataset], Dataset]] = None,
     dataset_transformer_valid: Optional[Callable[[Dataset], Dataset]] = None,
     persistent_workers: bool = True,
+    as_uint8: bool = False,
+    pin_memory: bool = False,
+    prefetch_factor: Optional[int] = None,
 ) -> Datasets:
+    """
+    Create the MNIST dataset
+
+    Args:
+        normalize_0_1: if True, the images are float in range [0, 1], else in range [0, 255]
+        as_uint8: if True, the images are kept as uint8 in range [0, 255] (``normalize_0_1`` is ignored).
+            This is 4x less data to transfer to the GPU, where the intensity can be rescaled
+    """
 
     root = get_data_root(root)
 
@@ -32,9 +43,13 @@ def mnist_dataset(
     valid_dataset = torchvision.datasets.MNIST(root=root, train=False, download=True)
 
     def get_split(dataset, select_classes=None, transform=None, shuffle=False, max_samples=None, dataset_transformer=None):
-        normalization_factor = 1.0 if not normalize_0_1 else 255.0
+        if as_uint8:
+            images = dataset.data.view((-1, 1, 28, 28)).numpy()
+        else:
+            normalization_factor = 1.0 if not normalize_0_1 else 255.0
+            images = dataset.data.view((-1, 1, 28, 28)).float().numpy() / normalization_factor
         ds = {
-            'images': dataset.data.view((-1, 1, 28, 28)).float().numpy() / normalization_factor,
+            'images': images,
             'targets': dataset.targets.view(-1, 1),
         }
 
@@ -62,6 +77,9 @@ def mnist_dataset(
             num_workers=num_workers,
             sampler=sampler,
             persistent_workers=persistent_workers if num_workers > 0 else False,
+            # can't have this option if no worker
+            prefetch_factor=prefetch_factor if num_workers > 0 else None,
+            pin_memory=pin_memory,
             drop_last=True,
         )
 
@@ -5,7 +5,7 @@ import torch
 from .discrete_beta_schedulers import linear, NoisingSchedule
 from .discrete_sampling import sample_ddpm, forward_gaussian_diffusion
 from .discrete_scheduler_time import rand_uniform_steps
-from .utils import expand_dim_like
+from .utils import CUDAGraphModel, expand_dim_like
 from ..types import TorchTensorN, TorchTensorNX
 from .types import Model
 
@@ -35,8 +35,13 @@ class SimpleGaussianDiffusion(Model):
             noise_scheduler_fn: Callable[[int], NoisingSchedule] = linear,
             timestep_training_fn: Callable[[int, int], int] = rand_uniform_steps,
             sample_fn = sample_ddpm,
-            loss_fn = loss_mse):
+            loss_fn = loss_mse,
+            sample_cuda_graph: bool = False):
         """
+        Args:
+            sample_cuda_graph: if True, the model forward is captured in a CUDA graph during
+                the sampling and replayed for each denoising step (CUDA only). Do not combine
+                with a model compiled with the ``reduce-overhead`` mode, which already uses CUDA graphs
         """
         super().__init__()
         sched = noise_scheduler_fn()
@@ -49,6 +54,7 @@ class SimpleGaussianDiffusion(Model):
         self.loss_fn = loss_fn
         self.sample_fn = sample_fn
         self.timestep_training_fn = timestep_training_fn
+        self.sample_cuda_graph = sample_cuda_graph
 
         # make sure the tensors are moved to the correct device
         # by registering them as buffers
@@ -75,12 +81,18 @@ class SimpleGaussianDiffusion(Model):
         return forward_gaussian_diffusion(x0=x0, t=t, ᾱ=self.ᾱ)
 
     def sample(self, batch_shape: Sequence[int], x_T: Optional[TorchTensorNX] = None, **model_extra_kwargs) -> TorchTensorNX:
+        model = self.model
+        if self.sample_cuda_graph and self.α.device.type == 'cuda':
+            # the graph is captured for each sampling: the capture cost is
+            # amortized over the denoising steps
+            model = CUDAGraphModel(model)
+
         return self.sample_fn(
             α=self.α,
             ᾱ=self.ᾱ,
             σ=self.σ,
             device=self.α.device,
-            model=self.model,
+            model=model,
             batch_shape=batch_shape,
             x_T=x_T,
             model_extra_kwargs=model_extra_kwargs
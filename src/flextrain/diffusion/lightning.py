@@ -18,13 +18,20 @@ class GaussianDiffusionLightning(L.LightningModule):
         input_conditioning_names: Optional[Union[str, Sequence[str]]] = None,
         optimizer_fn: Callable[[L.LightningModule], torch.optim.Optimizer] = partial(torch.optim.Adam, lr=5e-4),
         scheduler_steps_fn: Optional[Callable[[torch.optim.Optimizer], torch.optim.lr_scheduler.LRScheduler]] = None,
+        batch_transform_fn: Optional[Callable[[Batch], Batch]] = None,
     ) -> None:
+        """
+        Args:
+            batch_transform_fn: a transform applied on the batch once transferred to the device
+                (e.g., noising on the GPU rather than in the data loader workers)
+        """
         super().__init__()
         self.model = model
         self.input_name = input_name
         self.input_conditioning_names = input_conditioning_names
         self.optimizer_fn = optimizer_fn
         self.scheduler_steps_fn = scheduler_steps_fn
+        self.batch_transform_fn = batch_transform_fn
 
         if isinstance(self.input_conditioning_names, str):
             self.input_conditioning_names = [self.input_conditioning_names]
@@ -54,6 +61,11 @@ class GaussianDiffusionLightning(L.LightningModule):
         loss = sum(losses.values())
         return loss
 
+    def on_after_batch_transfer(self, batch: Batch, dataloader_idx: int) -> Batch:
+        if batch is None or self.batch_transform_fn is None:
+            return batch
+        return self.batch_transform_fn(batch)
+
     def training_step(self, batch: Batch, _: Any) -> TorchTensorNX:
         if batch is None:
             return None
@@ -0,0 +1,72 @@
+import logging
+from typing import Any, Callable, Sequence
+
+import torch
+from torch._dynamo.exc import TorchDynamoException, TorchRuntimeError
+
+logger = logging.getLogger(__name__)
+
+
+def is_compilation_error(e: Exception) -> bool:
+    """
+    Return True if the exception is a failure of the compiler rather than of the compiled code
+    """
+    if not isinstance(e, TorchDynamoException):
+        return False
+    if isinstance(e, TorchRuntimeError):
+        # error in the traced user code (e.g., shape mismatch)
+        return False
+    # e.g., `BackendCompilerFailed` wraps the original error
+    inner_exception = getattr(e, 'inner_exception', None)
+    return not isinstance(inner_exception, torch.cuda.OutOfMemoryError)
+
+
+class CompiledFunction:
+    """
+    Wrap a function or module with ``torch.compile``, falling back to more conservative
+    modes if the compilation fails.
+
+    ``torch.compile`` is lazy and only raises when a call (re)compiles the function, e.g.,
+    the first call or a call with new shapes or grad mode. Only compiler errors trigger the
+    fallback, any other error is raised. If all the modes fail, the function is run eagerly.
+
+    >>> encoder = CompiledFunction(nn.Conv2d(1, 8, kernel_size=3), modes=('reduce-overhead', 'default'))
+    >>> o = encoder(torch.zeros([10, 1, 28, 28]))
+
+    Note:
+        the wrapped module is NOT registered as a sub-module: the parameters must be owned
+        by the original module so that checkpoints and EMA see the raw parameters.
+    """
+
+    def __init__(
+        self, fn: Callable[..., Any], modes: Sequence[str] = ('reduce-overhead', 'default'), **compile_kwargs: Any
+    ) -> None:
+        self.fn = fn
+        self.modes = list(modes)
+        self.compile_kwargs = compile_kwargs
+        self.mode_n = 0
+        self.compiled_fn = self._compile()
+
+    def _compile(self) -> Callable[..., Any]:
+        while self.mode_n < len(self.modes):
+            mode = self.modes[self.mode_n]
+            try:
+                return torch.compile(self.fn, mode=mode, **self.compile_kwargs)
+            except Exception as e:
+                logger.warning(f'torch.compile failed with mode={mode}, error={e}')
+                self.mode_n += 1
+
+        logger.warning('torch.compile failed for all modes, using eager mode!')
+        return self.fn
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        while True:
+            try:
+                return self.compiled_fn(*args, **kwargs)
+            except Exception as e:
+                if self.compiled_fn is self.fn or not is_compilation_error(e):
+                    # not a compilation error (e.g., out of memory, invalid inputs)
+                    raise
+                logger.warning(f'torch.compile failed with mode={self.modes[self.mode_n]}, error={e}')
+                self.mode_n += 1
+                self.compiled_fn = self._compile()
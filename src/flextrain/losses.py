@@ -406,7 +406,7 @@ class LossCrossEntropy(nn.Module):
         if self.class_weights is not None:
             if self.class_weights == 'adaptative':
                 nb_classes = torch.bincount(torch.flatten(targets), minlength=model_output.shape[1])
-                nb_voxels = torch.prod(torch.asarray(targets.shape), dtype=torch.int64)
+                nb_voxels = targets.numel()
                 w = (nb_voxels / nb_classes) / 5
 
                 if self.weight_min_max_adaptative is not None:
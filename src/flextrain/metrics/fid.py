@@ -2,20 +2,25 @@ from torch import nn
 import torch
 from ..types import Batch
 from..trainer.utils import transfer_batch_to_device, len_batch
-from typing import Optional, Sequence
+from typing import List, Optional, Sequence
 from .sqrtm import sqrtm_newton_schulz
 from scipy.linalg import sqrtm
 import warnings
 
 
 class FID(nn.Module):
-    def __init__(self, model: nn.Module) -> None:
+    def __init__(self, model: nn.Module, autocast_dtype: Optional[torch.dtype] = None) -> None:
         """
         The model used to extract features
+
+        Args:
+            autocast_dtype: if not None, the features are extracted under autocast with this
+                type (e.g., ``torch.bfloat16``). The features are always returned as float32
         """
         super().__init__()
         self.model = model
         self.reference_features = None
+        self.autocast_dtype = autocast_dtype
     
     def fit(self, dataloader: Sequence[Batch], device: torch.device = torch.device('cpu'), target_nb_samples: int = 1000) -> None:
         """
@@ -28,13 +33,17 @@ class FID(nn.Module):
         self.model = self.model.to(device)
         self.model.eval()
         all_features = []
+        # FID may have been serialized before `autocast_dtype` was introduced
+        autocast_dtype = getattr(self, 'autocast_dtype', None)
         for batch in dataloader:
             batch = transfer_batch_to_device(batch, device)
             nb_samples = len_batch(batch)
-            with torch.no_grad():  # no need for gradient
-                features = self.model(batch)
+            with torch.inference_mode():  # no need for gradient nor view tracking
+                with torch.autocast(device.type, dtype=autocast_dtype, enabled=autocast_dtype is not None):
+                    features = self.model(batch)
 
-            all_features.append(features.detach().cpu())
+            # the statistics (mean, covariance) must be calculated in float32
+            all_features.append(features.detach().float().cpu())
             total_samples += nb_samples
             if target_nb_samples is not None and total_samples >= target_nb_samples:
                 # we have enough samples to calculate the statistics
@@ -74,6 +83,28 @@ class FID(nn.Module):
         fid = (((m1 - m2)**2).sum() + c1.trace() + c2.trace() - 2 * csr.trace()).item()
         return fid
 
+    def calculate_fid_subsampled(
+            self,
+            features: torch.Tensor,
+            nb_subsets: int = 10,
+            device: torch.device = torch.device('cpu'),
+            generator: Optional[torch.Generator] = None) -> List[float]:
+        """
+        Calculate the FID of random subsets of pre-computed features against reference features
+
+        Each subset is drawn without replacement (i.e., subsampling, not bootstrapping) and has
+        the same number of samples as the reference features so that the FIDs are comparable.
+        The features are calculated only once for all the subsets.
+        """
+        nb_samples = self.get_target_nb_samples()
+        assert len(features) >= nb_samples, f'not enough features. Got={len(features)}, expected={nb_samples}'
+        weights = torch.ones(len(features))
+        fids = []
+        for _ in range(nb_subsets):
+            indices = torch.multinomial(weights, nb_samples, replacement=False, generator=generator)
+            fids.append(self.calculate_fid_from_features(features[indices], device=device))
+        return fids
+
     def forward(self, dataloader: Sequence[Batch], device: torch.device = torch.device('cpu')) -> torch.Tensor:
         """
         Calculate the FID for the given samples
@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 from torch import nn
 import torch
 
@@ -14,16 +15,33 @@ def mnist_image_adapator(dataloader):
         yield batch['images']
 
 
-def create_fid_mnist(default_model_root='/tmp/', batch_size: int = 1000, force_create: bool = False, target_nb_samples: int = 4000, del_layers: int = 1, remove_prefix: str='base_model.') -> nn.Module:
+def create_fid_mnist(
+        default_model_root='/tmp/',
+        batch_size: int = 1000,
+        force_create: bool = False,
+        target_nb_samples: int = 4000,
+        del_layers: int = 1,
+        remove_prefix: str = 'base_model.',
+        autocast_dtype: Optional[torch.dtype] = None,
+        device: torch.device = torch.device('cpu')) -> nn.Module:
     """
     Helper to create a FID metric
 
     force_create: force the creation of the FID features
+    autocast_dtype: the features (including the reference features) are extracted under autocast
+        with this type. The reference features are cached separately for each type and device
+    device: the device used to extract the reference features. With ``autocast_dtype``, this must be
+        the device type used for the current features so that the autocast is the same
     """
     model = create_model()
     root_output = default('OUTPUT_ARTEFACT_ROOT', default_value=default_model_root)
     pretrained_path = os.path.join(root_output, 'mnist_28_classifier.pth')
-    fid_path = os.path.join(root_output, 'mnist_28_fid.pth')
+    if autocast_dtype is None:
+        fid_path = os.path.join(root_output, 'mnist_28_fid.pth')
+    else:
+        # autocast on CPU and CUDA do not produce the same features
+        dtype_name = str(autocast_dtype).replace('torch.', '')
+        fid_path = os.path.join(root_output, f'mnist_28_fid_{dtype_name}_{device.type}.pth')
     if not force_create and os.path.exists(fid_path):
         with open(fid_path, 'rb') as f:
             fid = torch.load(f)
@@ -46,8 +64,10 @@ def create_fid_mnist(default_model_root='/tmp/', batch_size: int = 1000, force_c
         shuffle_valid=False
     )
 
-    fid = FID(model=model_pl)
-    fid.fit(mnist_image_adapator(datasets['mnist']['valid']), target_nb_samples=target_nb_samples)  # use never seen data (valid)
+    fid = FID(model=model_pl, autocast_dtype=autocast_dtype)
+    # use never seen data (valid)
+    fid.fit(mnist_image_adapator(datasets['mnist']['valid']), device=device, target_nb_samples=target_nb_samples)
+    fid.cpu()
 
     # make sure we cache the calculated features
     with open(fid_path, 'wb') as f:
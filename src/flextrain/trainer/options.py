@@ -28,6 +28,8 @@ class Training(SimpleRepr):
         gradient_clip_algorithm: Optional[Literal['value', 'norm']] = None,
         enable_checkpointing: Optional[bool] = None,
         detect_anomaly: bool = False,
+        compile_model: bool = False,
+        grad_checkpoint: bool = False,
     ) -> None:
         self.devices = '0'
         self.nb_epochs = nb_epochs
@@ -41,6 +43,8 @@ class Training(SimpleRepr):
         self.check_val_every_n_epoch = check_val_every_n_epoch
         self.enable_checkpointing = enable_checkpointing
         self.detect_anomaly = detect_anomaly
+        self.compile_model = compile_model
+        self.grad_checkpoint = grad_checkpoint
 
 
 class Data(SimpleRepr):
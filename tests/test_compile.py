@@ -0,0 +1,72 @@
+import pytest
+import torch
+from torch._dynamo.exc import TorchDynamoException
+
+from flextrain.layers.compile import CompiledFunction
+
+
+def make_fake_compile(failures):
+    """
+    Fake `torch.compile`: the compiled function raises `failures[mode]` if defined
+    """
+    def fake_compile(fn, mode, **kwargs):
+        def compiled_fn(*args, **kwargs):
+            if mode in failures:
+                raise failures[mode]
+            return fn(*args, **kwargs)
+
+        return compiled_fn
+
+    return fake_compile
+
+
+def test_compiled_function_fallback(monkeypatch):
+    monkeypatch.setattr(torch, 'compile', make_fake_compile({'reduce-overhead': TorchDynamoException('failed')}))
+    f = CompiledFunction(lambda x: x + 1, modes=('reduce-overhead', 'default'))
+    assert f(1) == 2
+    assert f.modes[f.mode_n] == 'default'
+
+
+def test_compiled_function_fallback_eager(monkeypatch):
+    failures = {'reduce-overhead': TorchDynamoException('failed'), 'default': TorchDynamoException('failed')}
+    monkeypatch.setattr(torch, 'compile', make_fake_compile(failures))
+    fn = lambda x: x + 1  # noqa: E731
+    f = CompiledFunction(fn, modes=('reduce-overhead', 'default'))
+    assert f(1) == 2
+    assert f.compiled_fn is fn
+
+
+@pytest.mark.parametrize('error', [torch.cuda.OutOfMemoryError('oom'), ValueError('invalid input')])
+def test_compiled_function_reraise(monkeypatch, error):
+    """
+    Errors not related to the compilation must be raised without fallback
+    """
+    monkeypatch.setattr(torch, 'compile', make_fake_compile({'reduce-overhead': error}))
+    f = CompiledFunction(lambda x: x + 1, modes=('reduce-overhead', 'default'))
+    with pytest.raises(type(error)):
+        f(1)
+    assert f.mode_n == 0
+
+
+def test_compiled_function_fallback_recompilation(monkeypatch):
+    """
+    A recompilation (e.g., new shapes) may fail after successful calls
+    """
+    nb_calls = {'reduce-overhead': 0}
+
+    def fake_compile(fn, mode, **kwargs):
+        def compiled_fn(*args, **kwargs):
+            if mode == 'reduce-overhead':
+                nb_calls[mode] += 1
+                if nb_calls[mode] == 2:
+                    raise TorchDynamoException('failed')
+            return fn(*args, **kwargs)
+
+        return compiled_fn
+
+    monkeypatch.setattr(torch, 'compile', fake_compile)
+    f = CompiledFunction(lambda x: x + 1, modes=('reduce-overhead', 'default'))
+    assert f(1) == 2
+    assert f.modes[f.mode_n] == 'reduce-overhead'
+    assert f(2) == 3
+    assert f.modes[f.mode_n] == 'default'
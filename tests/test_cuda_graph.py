@@ -0,0 +1,45 @@
+import pytest
+import torch
+from torch import nn
+
+from flextrain.diffusion.utils import CUDAGraphModel
+
+
+class TimeConditionedModel(nn.Module):
+    def __init__(self) -> None:
+        super().__init__()
+        self.conv = nn.Conv2d(2, 1, kernel_size=3, padding=1)
+
+    def forward(self, x: torch.Tensor, t: torch.Tensor, conditioning: torch.Tensor) -> torch.Tensor:
+        o = self.conv(torch.cat([x, conditioning], dim=1))
+        return o + t.float().view(-1, 1, 1, 1) / 1000
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason='requires CUDA')
+def test_cuda_graph_replay_matches_eager():
+    torch.manual_seed(0)
+    model = TimeConditionedModel().cuda().eval()
+    graph_model = CUDAGraphModel(model)
+
+    with torch.no_grad():
+        for step in range(4):
+            x = torch.randn([3, 1, 8, 8], device='cuda')
+            t = torch.full([3], step, device='cuda', dtype=torch.long)
+            conditioning = torch.randn([3, 1, 8, 8], device='cuda')
+            expected = model(x, t, conditioning)
+            o = graph_model(x, t, conditioning).clone()
+            assert torch.allclose(o, expected, atol=1e-4)
+            if step == 0:
+                graph = graph_model.graph
+            # same shapes: the graph is replayed, not captured again
+            assert graph_model.graph is graph
+
+        # different batch size: the graph must be captured again
+        x = torch.randn([5, 1, 8, 8], device='cuda')
+        t = torch.full([5], 10, device='cuda', dtype=torch.long)
+        conditioning = torch.randn([5, 1, 8, 8], device='cuda')
+        expected = model(x, t, conditioning)
+        o = graph_model(x, t, conditioning)
+        assert graph_model.graph is not graph
+        assert o.shape == (5, 1, 8, 8)
+        assert torch.allclose(o, expected, atol=1e-4)
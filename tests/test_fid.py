@@ -0,0 +1,33 @@
+import pytest
+import torch
+from torch import nn
+
+from flextrain.metrics.fid import FID
+
+
+def make_fid(nb_reference_samples: int = 20) -> FID:
+    torch.manual_seed(0)
+    fid = FID(nn.Identity())
+    fid.reference_features = torch.randn([nb_reference_samples, 4], dtype=torch.float64)
+    return fid
+
+
+def test_fid_subsampled():
+    fid = make_fid()
+    features = torch.randn([50, 4], dtype=torch.float64)
+
+    fids = fid.calculate_fid_subsampled(features, nb_subsets=5, generator=torch.Generator().manual_seed(42))
+    assert len(fids) == 5
+    assert all(f >= -1e-6 for f in fids)
+    # different subsets
+    assert len(set(fids)) > 1
+
+    # same generator state, same subsets
+    fids_2 = fid.calculate_fid_subsampled(features, nb_subsets=5, generator=torch.Generator().manual_seed(42))
+    assert fids == pytest.approx(fids_2)
+
+
+def test_fid_subsampled_not_enough_features():
+    fid = make_fid()
+    with pytest.raises(AssertionError):
+        fid.calculate_fid_subsampled(torch.randn([10, 4], dtype=torch.float64), nb_subsets=2)
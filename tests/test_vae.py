@@ -0,0 +1,143 @@
+import pytest
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+from flextrain.autoencoder.vae import (
+    AutoencoderConvolutionalVariational,
+    kullback_leibler_per_sample,
+    reconstruction_loss_per_sample,
+)
+
+
+def make_vae(z_size: int = 16, **kwargs) -> AutoencoderConvolutionalVariational:
+    encoder = nn.Sequential(nn.Conv2d(1, 4, kernel_size=3, padding=1), nn.MaxPool2d(2))
+    decoder = nn.Sequential(nn.Upsample(scale_factor=2), nn.Conv2d(4, 1, kernel_size=3, padding=1))
+    x = torch.zeros([2, 1, 8, 8])
+    return AutoencoderConvolutionalVariational(
+        x, cnn_dim=4, encoder=encoder, decoder=decoder, z_size=z_size, **kwargs
+    )
+
+
+def test_vae_forward_sample():
+    vae = make_vae()
+    assert vae.encoder_output_size == 4 * 4 * 4
+
+    recon, mu, logvar = vae(torch.randn([5, 1, 8, 8]))
+    assert recon.shape == (5, 1, 8, 8)
+    assert mu.shape == (5, 16)
+    assert logvar.shape == (5, 16)
+
+    # the number of samples is independent of the batch used for the construction
+    samples = vae.sample(3)
+    assert samples.shape == (3, 1, 8, 8)
+
+
+def test_vae_forward_twice_backward():
+    """
+    Several forwards may be accumulated before the backward (e.g., VAE part of a larger model)
+    """
+    vae = make_vae()
+    vae.train()
+    x = torch.randn([5, 1, 8, 8])
+    loss = vae(x)[0].sum() + vae(x)[0].sum()
+    loss.backward()
+    assert vae.z_proj.weight.grad is not None
+
+
+def test_vae_compiled_state_dict():
+    """
+    The compiled functions must not be registered as sub-modules
+    """
+    vae = make_vae()
+    vae_compiled = make_vae(compile_model=True)
+    expected_keys = {'z_proj.weight', 'z_proj.bias', 'z_to_decoder.weight', 'z_to_decoder.bias'}
+    expected_keys |= {f'encoder.{name}' for name in vae.encoder.state_dict().keys()}
+    expected_keys |= {f'decoder.{name}' for name in vae.decoder.state_dict().keys()}
+    assert set(vae.state_dict().keys()) == expected_keys
+    assert set(vae_compiled.state_dict().keys()) == expected_keys
+
+
+def test_vae_load_previous_version():
+    """
+    Previous versions had separate `z_mu` and `z_logvar` projections and
+    no `z_to_decoder` projection (i.e., z_size == encoder_output_size)
+    """
+    torch.manual_seed(0)
+    reference = make_vae(z_size=64)
+    z_mu = nn.Linear(64, 64)
+    z_logvar = nn.Linear(64, 64)
+    state_dict = {}
+    state_dict.update({f'encoder.{name}': value for name, value in reference.encoder.state_dict().items()})
+    state_dict.update({f'decoder.{name}': value for name, value in reference.decoder.state_dict().items()})
+    state_dict.update({f'z_mu.{name}': value for name, value in z_mu.state_dict().items()})
+    state_dict.update({f'z_logvar.{name}': value for name, value in z_logvar.state_dict().items()})
+
+    vae = make_vae(z_size=64)
+    vae.load_state_dict(state_dict)
+    vae.eval()
+
+    with torch.no_grad():
+        x = torch.randn([5, 1, 8, 8])
+        mu, logvar, encoded_shape = vae.encode(x)
+        recon = vae.decode(mu, logvar, encoded_shape)
+
+        # previous version: separate projections, `z` directly reshaped as an encoding
+        n = reference.encoder(x)
+        expected_mu = z_mu(n.flatten(1))
+        expected_logvar = z_logvar(n.flatten(1))
+        expected_recon = reference.decoder(expected_mu.view(n.shape))
+
+    assert torch.allclose(mu, expected_mu, atol=1e-6)
+    assert torch.allclose(logvar, expected_logvar, atol=1e-6)
+    assert torch.allclose(recon, expected_recon, atol=1e-5)
+
+    # the memory format must not change the meaning of the weights
+    vae_channels_last = make_vae(z_size=64, channels_last=True)
+    assert vae_channels_last.channels_last
+    vae_channels_last.load_state_dict(state_dict)
+    vae_channels_last.eval()
+    with torch.no_grad():
+        recon_channels_last, mu_channels_last, _ = vae_channels_last(x)
+    assert torch.allclose(mu_channels_last, expected_mu, atol=1e-5)
+    assert torch.allclose(recon_channels_last, expected_recon, atol=1e-5)
+
+
+def test_kullback_leibler_per_sample():
+    torch.manual_seed(0)
+    mu = torch.randn([5, 16])
+    logvar = torch.randn([5, 16])
+    kl = kullback_leibler_per_sample(mu, logvar)
+
+    expected = -0.5 * (1 + logvar - mu.pow(2) - logvar.exp())
+    expected = torch.flatten(expected, 1).mean(dim=1)
+    assert kl.shape == (5,)
+    assert torch.allclose(kl, expected, atol=1e-6)
+
+
+@pytest.mark.parametrize('recon_loss_name', ['BCEL', 'BCE', 'MSE', 'L1'])
+def test_reconstruction_loss_per_sample(recon_loss_name):
+    torch.manual_seed(0)
+    recon_x = torch.rand([5, 1, 8, 8])
+    x = torch.rand([5, 1, 8, 8])
+    loss = reconstruction_loss_per_sample(recon_x, x, recon_loss_name)
+
+    if recon_loss_name == 'BCEL':
+        expected = F.binary_cross_entropy_with_logits(recon_x, x, reduction='none')
+    elif recon_loss_name == 'BCE':
+        expected = F.binary_cross_entropy(recon_x, x, reduction='none')
+    elif recon_loss_name == 'MSE':
+        expected = F.mse_loss(recon_x, x, reduction='none')
+    else:
+        expected = torch.nn.PairwiseDistance(p=1, keepdim=True)(recon_x, x)
+    expected = torch.flatten(expected, 1).mean(dim=1)
+    assert loss.shape == (5,)
+    assert torch.allclose(loss, expected, atol=1e-6)
+
+
+def test_reconstruction_loss_per_sample_unknown():
+    x = torch.rand([5, 1, 8, 8])
+    with pytest.raises(NotImplementedError):
+        reconstruction_loss_per_sample(x, x, 'unknown')
+    with pytest.raises(NotImplementedError):
+        reconstruction_loss_per_sample(x, x, 'unknown', compile_loss=True)